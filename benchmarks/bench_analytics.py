@@ -0,0 +1,37 @@
+"""
+Overhead of funnel analytics for each message of a template (enter + answer).
+run: python -m benchmarks.bench_analytics
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from recorderbot.components.analytics import Analytics
+from recorderbot.components.storage import DataBase
+
+N = 100_000
+BUDGET = 10e-6  # seconds per message
+STEPS = [f"step{i}" for i in range(11)]
+
+
+def overhead(analytics: Analytics, n: int = N) -> float:
+    "average seconds spent on analytics for each message"
+    start = time.perf_counter()
+    for i in range(n):
+        user, step = i % 100, STEPS[i % len(STEPS)]
+        analytics.answer(user, user, "second-thoughts", step)
+        analytics.enter(user, user, "second-thoughts", step)
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as d:
+        db = DataBase(None, str(Path(d) / "db.json"), websync=False)
+        analytics = Analytics(db)
+        cost = overhead(analytics)
+        start = time.perf_counter()
+        flushed = analytics.flush()
+        flush = time.perf_counter() - start
+    print(f"per message: {cost * 1e6:.2f}us (budget {BUDGET * 1e6:.0f}us)")
+    print(f"flush {flushed} buffered event(s): {flush * 1e3:.1f}ms")
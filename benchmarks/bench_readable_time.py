@@ -0,0 +1,38 @@
+"""
+Compare formatting 100k timestamps with the old per-call arrow path,
+readable_time and the batch readable_times.
+run: python -m benchmarks.bench_readable_time
+"""
+
+import time
+
+import arrow
+
+from recorderbot.utils import TIMEZONE, readable_time, readable_times
+
+N = 100_000
+FORMAT = "YYYY-MM-DD HH:mm:ss"
+
+
+def arrow_time(timestamp: int, format: str = FORMAT) -> str:
+    "the original implementation of readable_time"
+    return arrow.get(timestamp).to(TIMEZONE).format(format)
+
+
+def bench(name: str, func, timestamps) -> float:
+    start = time.perf_counter()
+    func(timestamps)
+    cost = time.perf_counter() - start
+    print(f"{name:<16}{cost:8.3f}s {cost / len(timestamps) * 1e6:8.2f}us/item")
+    return cost
+
+
+if __name__ == "__main__":
+    timestamps = [1_600_000_000 + i * 937 for i in range(N)]
+    assert readable_times(timestamps) == [arrow_time(t) for t in timestamps]
+    base = bench("arrow", lambda ts: [arrow_time(t) for t in ts], timestamps)
+    single = bench(
+        "readable_time", lambda ts: [readable_time(t) for t in ts], timestamps
+    )
+    batch = bench("readable_times", readable_times, timestamps)
+    print(f"speedup: {base / single:.1f}x (single), {base / batch:.1f}x (batch)")
@@ -5,7 +5,14 @@ from typing import Final
 from decouple import config
 
 from recorderbot.bot import Bot
-from recorderbot.components import Authenticator, Recorder
+from recorderbot.components import (
+    Analytics,
+    Authenticator,
+    QueryServer,
+    QueryService,
+    Recorder,
+    Scheduler,
+)
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -22,8 +29,14 @@ if __name__ == "__main__":
     bot.register()
     auth = Authenticator(bot.bot, bot.storage)
     auth.register_command("register")
-    recorder = Recorder(bot.bot, bot.storage)
+    scheduler = Scheduler(bot.bot, bot.storage, zones=bot.zones)
+    scheduler.register_commands()
+    query = QueryService(bot.storage, zones=bot.zones)
+    query.register_commands()
+    analytics = Analytics(bot.storage)
+    analytics.register_commands()
+    recorder = Recorder(bot.bot, bot.storage, scheduler, analytics)
     recorder.register("configs/templates/")
     # WARNING: recorder 会接收所有 text 类型的消息，不要在此之后 register
 
-    bot.run()
+    bot.run(scheduler, QueryServer(query), analytics)
@@ -1,6 +1,7 @@
 import logging
 import os
 import time
+from functools import partial
 from typing import Final
 
 import telebot
@@ -9,8 +10,8 @@ from telebot.types import Message
 from telebot.util import extract_arguments, extract_command, quick_markup
 from telegram_text import Bold, Chain, Code, PlainText, TOMLSection, UnorderedList
 
-from .components import DataBase
-from .utils import load_yaml, readable_time
+from .components import DataBase, TimeZones
+from .utils import load_yaml
 
 BOT_TOKEN: Final = config("BOT_TOKEN", default="")
 BOT_USERNAME: Final = config("BOT_USERNAME", default="")
@@ -30,21 +31,35 @@ class Bot:
         self.bot = telebot.TeleBot(bot_token)
         self.cfg = load_yaml(config)
         self.storage = DataBase(self.bot, self.cfg["database"]["path"])
+        self.zones = TimeZones(self.bot, self.storage)
+        self.services = ()  # background services started by `run`
 
     def register(self):
         "register some common commands"
         bot: telebot.TeleBot = self.bot
         bot.register_message_handler(self.__command_start, commands=["start"])
-        bot.register_message_handler(timestamp, commands=["timestamp"], pass_bot=True)
+        bot.register_message_handler(
+            partial(timestamp, zones=self.zones), commands=["timestamp"], pass_bot=True
+        )
         self.storage.register_commands()
+        self.zones.register_commands()
 
-    def run(self):
+    def run(self, *services):
+        """
+        services: background services (with `start` & `stop`) to launch after
+        database is restored, e.g. Scheduler
+        """
         # initialize database, restore data from webdav backup
         self.storage.restore()
+        self.services = services
+        for service in services:
+            service.start()
         logging.info("Start Polling...")
         self.bot.infinity_polling()
 
     def stop(self):
+        for service in self.services:
+            service.stop()
         self.bot.stop_bot()
 
     def __command_start(self, message: Message):
@@ -55,6 +70,9 @@ class Bot:
         storage_status = self.storage.status.items()
         storage_status = [Bold(k) + PlainText(f": {v}") for k, v in storage_status]
         section_database = TOMLSection("all records", UnorderedList(*storage_status))
+        metrics = self.storage.metrics.items()
+        metrics = [Bold(k) + PlainText(f": {v}") for k, v in metrics]
+        section_metrics = TOMLSection("storage metrics", UnorderedList(*metrics))
 
         state: str | None = bot.get_state(user_id, chat_id)
         bot.delete_state(user_id, chat_id)
@@ -70,6 +88,7 @@ class Bot:
         msg = Chain(
             PlainText("Hello, how are you doing?"),
             section_database,
+            section_metrics,
             section_cmd,
             section_state,
             sep="\n\n",
@@ -77,10 +96,10 @@ class Bot:
         bot.send_message(message.chat.id, msg.to_markdown(), parse_mode="MarkdownV2")
 
 
-def timestamp(message: telebot.types.Message, bot: telebot.TeleBot):
+def timestamp(message: telebot.types.Message, bot: telebot.TeleBot, zones: TimeZones):
     if reply := message.reply_to_message:
         time = reply.date
-        msg = readable_time(time) + ": " + Code(str(time))
+        msg = zones.format(time, message.chat.id) + ": " + Code(str(time))
     else:
         msg = Bold(
             "You have to reply to a message and call this command to get its timestamp!"
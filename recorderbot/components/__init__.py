@@ -1,3 +1,8 @@
+from .analytics import Analytics
 from .authenticate import Authenticator
+from .query import QueryService
 from .record import Recorder
+from .scheduler import Scheduler
+from .server import QueryServer
 from .storage import DataBase
+from .zones import TimeZones
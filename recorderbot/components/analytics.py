@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Tuple
+
+import telebot
+from telebot.types import Message
+from telebot.util import extract_arguments
+from tinydb import Query, TinyDB
+
+from .storage import AtomicJSONStorage, DataBase
+
+EVENTS = ("entered", "answered", "abandoned")
+FIELDS = ("template", "step", "event", "chat_id", "user_id", "timestamp", "elapsed")
+
+
+class Analytics:
+    """
+    Per-step funnel of templates: how many users entered, answered or abandoned
+    each step, and time spent on it.
+    Events are appended to a ring buffer and counters are aggregated in memory,
+    both are flushed in batches by a background thread, so the overhead for
+    each message is only a few dict operations.
+    They are kept in a separate file (not backed up or restored with records)
+    and only the latest `max_events` events are retained.
+    """
+
+    tablename = "analytics"  # raw events
+    counters_tablename = "funnels"  # aggregated counters, one doc per template
+
+    def __init__(
+        self,
+        db: DataBase,
+        path: str = None,
+        capacity: int = 4096,
+        max_events: int = 10_000,
+        flush_interval: float = 60,
+        timeout: float = 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        db: database of records, whose bot is used for commands
+        path: file to flush events & counters to, defaults to
+            "<database>.analytics.json" next to the database
+        capacity: size of ring buffer, oldest events are dropped if it is full
+        max_events: number of latest events kept in file
+        flush_interval: seconds between flushes
+        timeout: seconds after which an unanswered step counts as abandoned
+        clock: function returning current timestamp, replaceable for testing
+        """
+        self.db = db
+        if path is None:
+            db_path = Path(db.db_path)
+            path = str(db_path.with_suffix(f".analytics{db_path.suffix}"))
+        self.store = TinyDB(path, storage=AtomicJSONStorage)
+        self.max_events = max_events
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.templates: Dict[str, Tuple[str, List[str]]] = {}  # name -> (cmd, steps)
+        # template -> step -> event / "seconds" -> count
+        self.counters: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.buffer: Deque[tuple] = deque(maxlen=capacity)
+        self.dropped = 0  # events dropped because buffer is full
+        # (chat_id, user_id) -> (template, step, entered at)
+        self._active: Dict[Tuple[int, int], Tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # only one flush writes the file
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+
+    @property
+    def bot(self) -> telebot.TeleBot:
+        return self.db.bot
+
+    def register_template(self, name: str, command: str, steps: List[str]):
+        "steps: keys of states in order, to show the funnel"
+        self.templates[name] = (command, steps)
+
+    def find_template(self, key: str) -> str | None:
+        "find template name by its name or command"
+        for name, (command, _) in self.templates.items():
+            if key in (name, command):
+                return name
+
+    def register_commands(self):
+        "make sure commands are registered before recorder handlers"
+        self.bot.register_message_handler(self.__command_funnel, commands=["funnel"])
+
+    def enter(self, chat_id: int, user_id: int, template: str, step: str):
+        "user is asked for a step, the previous unanswered step is abandoned"
+        now = self.clock()
+        with self._lock:
+            if previous := self._active.get((chat_id, user_id)):
+                self._count(chat_id, user_id, *previous, "abandoned", now)
+            self._active[(chat_id, user_id)] = (template, step, now)
+            self._count(chat_id, user_id, template, step, now, "entered", now)
+
+    def answer(self, chat_id: int, user_id: int, template: str, step: str):
+        "user answered a step"
+        now = self.clock()
+        with self._lock:
+            active = self._active.pop((chat_id, user_id), None)
+            entered = active[2] if active and active[:2] == (template, step) else now
+            self._count(chat_id, user_id, template, step, entered, "answered", now)
+
+    def _count(self, chat_id, user_id, template, step, entered, event, now):
+        "update counters and append event, lock is held by caller"
+        steps = self.counters.setdefault(template, {})
+        counter = steps.get(step)
+        if counter is None:
+            counter = steps[step] = dict.fromkeys(EVENTS + ("seconds",), 0)
+        counter[event] += 1
+        elapsed = now - entered
+        if event == "answered":
+            counter["seconds"] += elapsed
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((template, step, event, chat_id, user_id, now, elapsed))
+
+    def expire(self) -> int:
+        "mark steps unanswered for longer than timeout as abandoned"
+        now = self.clock()
+        with self._lock:
+            expired = [
+                (key, active)
+                for key, active in self._active.items()
+                if now - active[2] > self.timeout
+            ]
+            for (chat_id, user_id), active in expired:
+                del self._active[(chat_id, user_id)]
+                self._count(chat_id, user_id, *active, "abandoned", now)
+        return len(expired)
+
+    def flush(self) -> int:
+        """write buffered events and counters to analytics file
+        return: number of flushed events
+        """
+        self.expire()
+        with self._lock:
+            events = list(self.buffer)
+            self.buffer.clear()
+            counters = {
+                t: {s: dict(c) for s, c in v.items()} for t, v in self.counters.items()
+            }
+        if not events:
+            return 0
+        with self._flush_lock:
+            table = self.store.table(self.tablename)
+            try:
+                table.insert_multiple(dict(zip(FIELDS, event)) for event in events)
+            except Exception:
+                self.__requeue(events)
+                raise
+            if (excess := len(table) - self.max_events) > 0:
+                oldest = sorted(doc.doc_id for doc in table)[:excess]
+                table.remove(doc_ids=oldest)
+            table = self.store.table(self.counters_tablename)
+            for template, steps in counters.items():
+                table.upsert(
+                    {"template": template, "steps": steps}, Query().template == template
+                )
+        logging.info("flush %d analytics event(s)", len(events))
+        return len(events)
+
+    def __requeue(self, events: List[tuple]):
+        "put events back before newer ones, dropping the oldest if buffer is full"
+        with self._lock:
+            events += self.buffer
+            self.dropped += max(len(events) - self.buffer.maxlen, 0)
+            self.buffer.clear()
+            self.buffer.extend(events)
+
+    def load(self):
+        "load aggregated counters from database"
+        with self._lock:
+            for doc in self.store.table(self.counters_tablename):
+                self.counters[doc["template"]] = doc["steps"]
+
+    def funnel(self, template: str) -> List[Tuple[str, Dict[str, float]]]:
+        "counters of each step of template, in order of steps"
+        steps = self.templates.get(template, (None, []))[1]
+        with self._lock:
+            counters = self.counters.get(template, {})
+            steps = steps or list(counters)
+            empty = dict.fromkeys(EVENTS + ("seconds",), 0)
+            return [(step, dict(counters.get(step, empty))) for step in steps]
+
+    def start(self):
+        "load counters and start flushing periodically"
+        self.load()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.__loop, name="analytics", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def __loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("failed to flush analytics")
+
+    def __command_funnel(self, message: Message):
+        "/funnel template"
+        bot: telebot.TeleBot = self.bot
+        key = extract_arguments(message.text or "").strip()
+        if (template := self.find_template(key)) is None:
+            names = ", ".join(self.templates)
+            bot.send_message(message.chat.id, f"Usage: /funnel <template>\n{names}")
+            return
+        lines = [f"{template}: entered / answered / abandoned, avg time"]
+        for i, (step, c) in enumerate(self.funnel(template), 1):
+            avg = c["seconds"] / c["answered"] if c["answered"] else 0
+            lines.append(
+                f"{i}. {step}: {c['entered']} / {c['answered']} / {c['abandoned']}"
+                f", {avg:.0f}s"
+            )
+        bot.send_message(message.chat.id, "\n".join(lines))
@@ -0,0 +1,221 @@
+import re
+import time
+from functools import lru_cache
+from collections import deque
+from itertools import count
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import telebot
+from telebot.types import CallbackQuery, Message
+from telebot.util import extract_arguments, quick_markup
+
+from ..utils import readable_times
+from .storage import DataBase, DocumentReader
+from .zones import TimeZones
+
+Page = NamedTuple("Page", [("items", List[dict]), ("cursor", Optional[int])])
+Page.__doc__ = "items: records with `doc_id`, cursor: pass it to get next page"
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_duration(text: str) -> int:
+    """Parse duration like "30m", "7d", "2w" into seconds
+
+    Raises:
+        ValueError: if text is not a valid duration
+    """
+    match = re.fullmatch(r"(\d+)([smhdw])", text.strip().lower())
+    if match is None:
+        raise ValueError(f"invalid duration: {text}")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def matches(doc: dict, since: int = None, until: int = None, where: Tuple = ()) -> bool:
+    "check a raw document against time range [since, until) and field values"
+    if since is not None or until is not None:
+        t = doc.get("timestamp")
+        if t is None:
+            return False
+        if since is not None and t < since:
+            return False
+        if until is not None and t >= until:
+            return False
+    for key, value in where:
+        v = doc.get(key)
+        if v != value and str(v) != str(value):  # values from user are strings
+            return False
+    return True
+
+
+class QueryService:
+    """
+    Read records back from DataBase, newest first, with cursor based pagination.
+    Results are cached (LRU), keyed by database version, so any write makes
+    previous results unreachable.
+    Uncached queries stream the database file: only the requested table is
+    scanned, up to the cursor, and only the documents of one page are kept.
+    """
+
+    def __init__(
+        self,
+        db: DataBase,
+        cache_size: int = 128,
+        page_size: int = 10,
+        clock: Callable[[], float] = time.time,
+        zones: TimeZones = None,
+    ) -> None:
+        """
+        zones: if given, /list shows time in the timezone of the chat
+        """
+        self.db = db
+        self.zones = zones
+        self.now = clock
+        self.page_size = page_size
+        self._find = lru_cache(maxsize=cache_size)(self.__find)
+        self._listings: Dict[str, tuple] = {}  # filters of /list, for "more" button
+        self._listing_id = count()
+
+    def cache_clear(self):
+        self._find.cache_clear()
+
+    def cache_info(self):
+        return self._find.cache_info()
+
+    @property
+    def tables(self) -> List[str]:
+        return sorted(self.db.database.tables())
+
+    def find(
+        self,
+        table: str,
+        since: int = None,
+        until: int = None,
+        where: Dict[str, Any] = None,
+        cursor: int = None,
+        limit: int = None,
+    ) -> Page:
+        """Find records of table
+
+        Args:
+            table (str): table name
+            since (int, optional): earliest timestamp (included). Defaults to None.
+            until (int, optional): latest timestamp (excluded). Defaults to None.
+            where (dict, optional): field values to match. Defaults to None.
+            cursor (int, optional): cursor of previous page. Defaults to None.
+            limit (int, optional): page size. Defaults to `page_size`.
+
+        Returns:
+            Page: matched records and cursor of next page (None if no more)
+        """
+        where = tuple(sorted((where or {}).items()))
+        limit = limit or self.page_size
+        # version is read before data, a result can only be older than its key
+        return self._find(self.db.version, table, since, until, where, cursor, limit)
+
+    def __find(self, version, table, since, until, where, cursor, limit) -> Page:
+        # newest matches before cursor, and one more to tell if there is next page
+        matched: Deque[Tuple[int, dict]] = deque(maxlen=limit + 1)
+        with open(self.db.db_path, encoding="utf-8") as f:
+            for name, documents in DocumentReader(f).tables():
+                if name != table:
+                    continue
+                for doc_id, doc in documents:  # doc ids increase in file order
+                    if cursor is not None and doc_id >= cursor:
+                        break
+                    if matches(doc, since, until, where):
+                        matched.append((doc_id, doc))
+                break
+        items = []
+        for doc_id, doc in list(reversed(matched))[:limit]:
+            item = dict(doc, doc_id=doc_id)
+            item.pop(self.db.keyfield, None)  # internal identity of record
+            items.append(item)
+        return Page(items, items[-1]["doc_id"] if len(matched) > limit else None)
+
+    def register_commands(self):
+        "make sure commands are registered before recorder handlers"
+        self.bot.register_message_handler(self.__command_list, commands=["list"])
+        self.bot.register_callback_query_handler(
+            self.__more, lambda query: (query.data or "").startswith("list:")
+        )
+
+    @property
+    def bot(self) -> telebot.TeleBot:
+        return self.db.bot
+
+    def __command_list(self, message: Message):
+        "/list [table] [last 7d] [key=value ...]"
+        bot: telebot.TeleBot = self.bot
+        args = extract_arguments(message.text or "").split()
+        if not args:
+            tables = ", ".join(self.tables)
+            bot.send_message(
+                message.chat.id, f"Usage: /list <table> [last 7d] [key=value]\n{tables}"
+            )
+            return
+        table, since, where = args[0], None, {}
+        try:
+            rest = iter(args[1:])
+            for arg in rest:
+                if arg == "last":
+                    since = int(self.now()) - parse_duration(next(rest))
+                elif "=" in arg:
+                    key, _, value = arg.partition("=")
+                    where[key] = value
+                else:
+                    raise ValueError(arg)
+        except (ValueError, StopIteration):
+            bot.send_message(
+                message.chat.id, "Usage: /list <table> [last 7d] [key=value]"
+            )
+            return
+        # filters are kept in memory, callback data only carries a short key
+        key = self.__remember((table, since, where))
+        self.__send_page(message.chat.id, key, None)
+
+    def __more(self, query: CallbackQuery):
+        _, key, cursor = query.data.split(":")
+        self.bot.edit_message_reply_markup(
+            query.message.chat.id, query.message.message_id, reply_markup=None
+        )
+        if key not in self._listings:
+            self.bot.answer_callback_query(query.id, "expired, please /list again")
+            return
+        self.__send_page(query.message.chat.id, key, int(cursor))
+
+    def __remember(self, listing: tuple, capacity: int = 256) -> str:
+        key = str(next(self._listing_id))
+        self._listings[key] = listing
+        if len(self._listings) > capacity:
+            self._listings.pop(next(iter(self._listings)))  # drop the oldest
+        return key
+
+    def __send_page(self, chat_id: int, key: str, cursor: Optional[int]):
+        table, since, where = self._listings[key]
+        page = self.find(table, since=since, where=where, cursor=cursor)
+        if not page.items:
+            self.bot.send_message(chat_id, "Nothing found 🤖")
+            return
+        timestamps = [item.get("timestamp") for item in page.items]
+        if self.zones is not None:
+            times = self.zones.format_many(timestamps, chat_id)
+        else:
+            times = readable_times(timestamps)
+        text = "\n\n".join(map(format_record, page.items, times))
+        markup = None
+        if page.cursor is not None:
+            markup = quick_markup(
+                {"More ⏬": {"callback_data": f"list:{key}:{page.cursor}"}}
+            )
+        self.bot.send_message(chat_id, text, reply_markup=markup)
+
+
+def format_record(item: dict, time: str = "") -> str:
+    "readable text of a record, time: formatted timestamp of it"
+    item = dict(item)
+    head = f"#{item.pop('doc_id', '')}"
+    if item.pop("timestamp", None) is not None:
+        head += " " + time
+    body = "\n".join(f"{k}: {v}" for k, v in item.items())
+    return f"{head}\n{body}"
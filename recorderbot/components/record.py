@@ -11,15 +11,34 @@ from telebot.util import extract_arguments, extract_command, quick_markup
 from telegram_text import Bold, Chain, PlainText, Underline
 
 from ..states.base import ComStates, StepState, StepStatesGroup
+from .analytics import Analytics
+from .scheduler import Scheduler
 from .storage import DataBase
 
-Record = NamedTuple("Record", [("table", str), ("data", dict)])
+Record = NamedTuple("Record", [("table", str), ("data", dict), ("key", str)])
+
+
+def message_key(message: Message) -> str:
+    "identity of a message, stays the same when telegram redelivers the update"
+    return f"{message.chat.id}:{message.message_id}"
 
 
 class Recorder:
-    def __init__(self, bot: telebot.TeleBot, db: DataBase) -> None:
+    def __init__(
+        self,
+        bot: telebot.TeleBot,
+        db: DataBase,
+        scheduler: Scheduler = None,
+        analytics: Analytics = None,
+    ) -> None:
+        """
+        scheduler: if given, templates with `schedule` can be subscribed as reminders
+        analytics: if given, record funnel events of each step
+        """
         self.bot = bot
         self.db = db
+        self.scheduler = scheduler
+        self.analytics = analytics
         self.state_group: List[StepStatesGroup] = []
 
     def register(self, cfg_path: str):
@@ -33,6 +52,14 @@ class Recorder:
             self.register_command(sg)
         for sg in self.state_group:
             self.register_states(sg)
+        if self.scheduler is not None:
+            for sg in self.state_group:
+                self.register_schedule(sg)
+        if self.analytics is not None:
+            for sg in self.state_group:
+                self.analytics.register_template(
+                    sg.name, sg.command, [s.key for s in sg.state_list]
+                )
 
         # By default, save to "records" table if no state is specified
         self.bot.register_message_handler(self.__default)
@@ -60,15 +87,42 @@ class Recorder:
             )
         return state_group
 
+    def register_schedule(self, state_group: StepStatesGroup):
+        "make state group available to scheduler if it declares a schedule"
+        if state_group.schedule:
+            self.scheduler.register_template(
+                state_group.name,
+                state_group.command,
+                state_group.schedule,
+                partial(self.prompt, entry_state=state_group.entry_state),
+            )
+
     def __enter(self, message: Message, entry_state: StepState):
+        self.start(message.chat.id, message.from_user.id, entry_state)
+
+    def prompt(self, chat_id: int, user_id: int, entry_state: StepState) -> bool:
+        """start the states group as a reminder, unless user is in the middle of
+        another one (or confirming a record), return False in that case
+        """
+        if self.bot.get_state(user_id, chat_id) is not None:
+            return False
+        self.start(chat_id, user_id, entry_state)
+        return True
+
+    def start(self, chat_id: int, user_id: int, entry_state: StepState):
+        "show description of the states group and ask for the first step"
         msg = Chain(
             Bold("Start a New Record:"),
             PlainText(entry_state.group.description),
             sep="\n",
         )
-        self.bot.send_message(message.chat.id, msg.to_markdown(), parse_mode="Markdown")
-        self.bot.set_state(message.from_user.id, entry_state, message.chat.id)
-        self.bot.send_message(message.chat.id, entry_state.hint)
+        self.bot.send_message(chat_id, msg.to_markdown(), parse_mode="Markdown")
+        self.bot.set_state(user_id, entry_state, chat_id)
+        self.bot.send_message(chat_id, entry_state.hint)
+        if self.analytics is not None:
+            self.analytics.enter(
+                chat_id, user_id, entry_state.group.name, entry_state.key
+            )
 
     def __move_on(
         self,
@@ -81,17 +135,26 @@ class Recorder:
         # save & retrieve data
         with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
             data[current_state.name] = text  # use name to store data
+        if analytics := self.analytics:
+            group_name = current_state.group.name
+            analytics.answer(
+                message.chat.id, message.from_user.id, group_name, current_state.key
+            )
         # move on to next step
         if next_state:
             bot.set_state(message.from_user.id, next_state, message.chat.id)
             bot.send_message(message.chat.id, next_state.hint)
+            if analytics:
+                analytics.enter(
+                    message.chat.id, message.from_user.id, group_name, next_state.key
+                )
         else:  # all states finished, check & save them
             final = current_state.group.get_data(data)
             final["timestamp"] = message.date  # add time of record
             self.__confirm_and_save(
                 message.chat.id,
                 message.from_user.id,
-                Record(current_state.group.name, final),
+                Record(current_state.group.name, final, message_key(message)),
             )
 
     def __default(self, message: Message, default_table: str = "records"):
@@ -104,6 +167,7 @@ class Recorder:
                 "timestamp": message.date,
                 "content": message.text,
             },
+            message_key(message),
         )
         self.__confirm_and_save(message.chat.id, message.from_user.id, record)
 
@@ -137,7 +201,7 @@ class Recorder:
             if query.data == "save":
                 with bot.retrieve_data(user_id, chat_id) as user_data:
                     record: Record = user_data[save_state.name]
-                    doc_id = self.db.insert(record.data, record.table)
+                    doc_id = self.db.insert(record.data, record.table, record.key)
                 self.db.backup()  # backup to webdav
                 logging.info("backup after new record added via webdav")
                 bot.edit_message_text(f"saved. ({doc_id})", chat_id, message_id)
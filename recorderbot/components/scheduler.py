@@ -0,0 +1,363 @@
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import arrow
+import telebot
+from telebot.types import Message
+from telebot.util import extract_arguments
+from telegram_text import Bold, Chain, Code, PlainText, UnorderedList
+from tinydb import Query
+from tinydb.table import Table
+
+from ..utils import TIMEZONE
+from .storage import DataBase
+from .zones import TimeZones
+
+# (chat_id, user_id) -> False if user is busy and prompt should be deferred
+Prompt = Callable[[int, int], Optional[bool]]
+Job = NamedTuple("Job", [("command", str), ("at", str), ("prompt", Prompt)])
+
+
+def next_occurrence(at: str, after: float, tz: str = TIMEZONE) -> float:
+    """Get the first timestamp strictly after `after` matching time of day `at`
+
+    Args:
+        at (str): time of day in "HH:mm" format
+        after (float): timestamp to start from
+        tz (str, optional): timezone of `at`. Defaults to TIMEZONE.
+
+    Returns:
+        float: timestamp of next occurrence
+    """
+    hour, minute = parse_time_of_day(at)
+    t = (
+        arrow.get(after)
+        .to(tz)
+        .replace(hour=hour, minute=minute, second=0, microsecond=0)
+    )
+    if t.timestamp() <= after:
+        t = t.shift(days=1)
+    return t.timestamp()
+
+
+def parse_time_of_day(at: str) -> Tuple[int, int]:
+    "parse 'HH:mm' into (hour, minute), raise ValueError if invalid"
+    hour, _, minute = str(at).partition(":")
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"invalid time of day: {at}")
+    return hour, minute
+
+
+class Scheduler:
+    """
+    Send template prompts to subscribed users at the time of day declared by
+    `schedule` in template yaml (or chosen by user).
+    Subscriptions are persisted in database, and kept in memory as a heap
+    ordered by next fire time, so a single thread sleeps until the earliest one.
+    Missed fires (e.g. bot is down) are fired once after restart.
+    """
+
+    tablename = "schedules"
+
+    def __init__(
+        self,
+        bot: telebot.TeleBot,
+        db: DataBase,
+        clock: Callable[[], float] = time.time,
+        zones: TimeZones = None,
+        defer: float = 15 * 60,
+    ) -> None:
+        """
+        bot: the telebot instance to send messages
+        db: database to persist subscriptions
+        clock: function returning current timestamp, replaceable for testing
+        zones: if given, time of day is in the timezone of the chat,
+            subscriptions are rescheduled when it is changed
+        defer: seconds to wait before prompting again if user is busy
+        """
+        self.bot = bot
+        self.db = db
+        self.clock = clock
+        self.zones = zones
+        self.defer = defer
+        db.state_tables.add(self.tablename)  # don't merge stale state on restore
+        if zones is not None:
+            zones.add_listener(self.reschedule)
+        self.jobs: Dict[str, Job] = {}  # template name -> job
+        self._heap: List[Tuple[float, int]] = []  # (next_fire, doc_id)
+        self._cond = threading.Condition()
+        self._thread: threading.Thread = None
+        self._running = False
+
+    @property
+    def table(self):
+        return self.db.database.table(self.tablename)
+
+    def register_template(self, name: str, command: str, at: str, prompt: Prompt):
+        """make a template available for scheduling
+        name: template name, used as key of subscriptions
+        command: template command, users can subscribe with it
+        at: default time of day to prompt, "HH:mm"
+        prompt: function to start the template for (chat_id, user_id)
+        """
+        parse_time_of_day(at)  # validate
+        self.jobs[name] = Job(command, at, prompt)
+
+    def find_template(self, key: str) -> str | None:
+        "find template name by its name or command"
+        for name, job in self.jobs.items():
+            if key in (name, job.command):
+                return name
+
+    def register_commands(self):
+        "make sure commands are registered before recorder handlers"
+        self.bot.register_message_handler(self.__command_remind, commands=["remind"])
+        self.bot.register_message_handler(
+            self.__command_unremind, commands=["unremind"]
+        )
+
+    def subscribe(
+        self, chat_id: int, user_id: int, template: str, at: str = None
+    ) -> int:
+        """prompt user with template daily at given time, replacing old subscription
+        return: doc id of subscription
+        """
+        at = at or self.jobs[template].at
+        tz = self.zones.get(chat_id) if self.zones else TIMEZONE
+        next_fire = next_occurrence(at, self.clock(), tz)
+        item = {
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "template": template,
+            "at": at,
+            "timezone": tz,
+            "next_fire": next_fire,
+        }
+        with self._cond:
+            doc_id = self.db.upsert(item, self.tablename, self.key(chat_id, template))
+            heapq.heappush(self._heap, (next_fire, doc_id))
+            self._cond.notify()
+        logging.info("schedule %s for chat %d at %s", template, chat_id, at)
+        return doc_id
+
+    def unsubscribe(self, chat_id: int, template: str) -> int:
+        "return: number of removed subscriptions"
+        with self._cond:
+            removed = self.db.remove(self.tablename, self.key(chat_id, template))
+        return int(removed)  # stale heap entries are skipped when popped
+
+    def reschedule(self, chat_id: int, tz: str) -> int:
+        """move subscriptions of chat to the same time of day in new timezone
+        return: number of rescheduled subscriptions
+        """
+        now = self.clock()
+        with self._cond:
+            subscriptions = self.subscriptions(chat_id)
+            for doc in subscriptions:
+                next_fire = next_occurrence(doc["at"], now, tz)
+                key = self.key(chat_id, doc["template"])
+                fields = {"timezone": tz, "next_fire": next_fire}
+                self.db.update(fields, self.tablename, key)
+                heapq.heappush(self._heap, (next_fire, doc.doc_id))
+            self._cond.notify()
+        return len(subscriptions)
+
+    @staticmethod
+    def key(chat_id: int, template: str) -> str:
+        "identity of subscription, one per template for each chat"
+        return f"{chat_id}:{template}"
+
+    def subscriptions(self, chat_id: int) -> List[dict]:
+        return self.table.search(Query().chat_id == chat_id)
+
+    def load(self):
+        "rebuild heap from database, dropping duplicated subscriptions"
+        latest: Dict[str, int] = {}
+        for doc in self.table:
+            key = self.key(doc["chat_id"], doc["template"])
+            latest[key] = max(latest.get(key, 0), doc.doc_id)
+
+        def deduplicate(table):
+            keep = {doc_id: key for key, doc_id in latest.items()}
+            if stale := [doc.doc_id for doc in table if doc.doc_id not in keep]:
+                table.remove(doc_ids=stale)
+            for doc in table:  # subscriptions added before keys were stored
+                if doc.get(self.db.keyfield) != keep[doc.doc_id]:
+                    table.update(
+                        {self.db.keyfield: keep[doc.doc_id]}, doc_ids=[doc.doc_id]
+                    )
+
+        with self._cond:
+            self.db.write(self.tablename, deduplicate)
+            self._heap = [(doc["next_fire"], doc.doc_id) for doc in self.table]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        logging.info("loaded %d schedule(s)", len(self._heap))
+
+    def next_timeout(self) -> float | None:
+        "seconds until next fire, None if nothing is scheduled"
+        with self._cond:
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - self.clock(), 0)
+
+    def run_pending(self) -> int:
+        """fire all due prompts and reschedule them, with one database write
+        return: number of fired prompts
+        """
+        with self._cond:
+            now = self.clock()
+            due: Dict[int, float] = {}  # doc_id -> fire time
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, doc_id = heapq.heappop(self._heap)
+                due[doc_id] = fire_at
+            if not due:
+                return 0
+
+            def reschedule(table: Table) -> List[Tuple[dict, float]]:
+                # unsubscribed or rescheduled entries don't match the table
+                docs = [doc for doc in table if due.get(doc.doc_id) == doc["next_fire"]]
+                # missed fires are collapsed into one, schedule from now on
+                fired = [
+                    (
+                        doc,
+                        next_occurrence(doc["at"], now, doc.get("timezone", TIMEZONE)),
+                    )
+                    for doc in docs
+                ]
+                if fired:  # in one write, update function gets documents by value
+                    key = lambda doc: self.key(doc["chat_id"], doc["template"])
+                    next_fires = {key(doc): t for doc, t in fired}
+                    table.update(
+                        lambda doc: doc.update(next_fire=next_fires[key(doc)]),
+                        doc_ids=[doc.doc_id for doc in docs],
+                    )
+                return fired
+
+            fired = self.db.write(self.tablename, reschedule)
+            for doc, next_fire in fired:
+                heapq.heappush(self._heap, (next_fire, doc.doc_id))
+
+        count, busy = 0, []
+        for doc, next_fire in fired:
+            job = self.jobs.get(doc["template"])
+            if job is None:
+                logging.warning("template %s is not available", doc["template"])
+                continue
+            try:
+                if job.prompt(doc["chat_id"], doc["user_id"]) is False:
+                    busy.append((doc.doc_id, next_fire))
+                else:
+                    count += 1
+            except Exception:
+                logging.exception("failed to prompt %s", doc["template"])
+        if busy:
+            self.postpone(busy, now + self.defer)
+        return count
+
+    def postpone(self, entries: List[Tuple[int, float]], retry: float) -> int:
+        """prompt again at retry, unless the next regular fire is earlier
+        entries: (doc_id, next_fire) of subscriptions whose users are busy
+        return: number of postponed subscriptions
+        """
+        expected = dict(entries)  # subscriptions changed in the meantime are kept
+
+        def postpone(table: Table) -> List[dict]:
+            docs = [
+                doc
+                for doc in table
+                if expected.get(doc.doc_id) == doc["next_fire"] > retry
+            ]
+            if docs:
+                table.update({"next_fire": retry}, doc_ids=[doc.doc_id for doc in docs])
+            return docs
+
+        with self._cond:
+            docs = self.db.write(self.tablename, postpone)
+            for doc in docs:
+                heapq.heappush(self._heap, (retry, doc.doc_id))
+            self._cond.notify()
+        for doc in docs:
+            logging.info(
+                "chat %d is busy, postpone %s", doc["chat_id"], doc["template"]
+            )
+        return len(docs)
+
+    def start(self):
+        "load subscriptions and start the scheduling thread"
+        self.load()
+        self._running = True
+        self._thread = threading.Thread(
+            target=self.__loop, name="scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    def __loop(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                self._cond.wait(self.next_timeout())  # wake up by notify or timeout
+                if not self._running:
+                    return
+            self.run_pending()
+
+    def __command_remind(self, message: Message):
+        "/remind [template] [HH:mm]"
+        bot: telebot.TeleBot = self.bot
+        args = extract_arguments(message.text or "").split()
+        if not args:
+            subs = [
+                Bold(s["template"]) + PlainText(f" at {s['at']}")
+                for s in self.subscriptions(message.chat.id)
+            ]
+            templates = [
+                Code(f"/remind {job.command} {job.at}") + PlainText(f" ({name})")
+                for name, job in self.jobs.items()
+            ]
+            msg = Chain(
+                Bold("Reminders:"),
+                UnorderedList(*subs) if subs else PlainText("nothing yet"),
+                Bold("Available:"),
+                UnorderedList(*templates),
+                sep="\n",
+            )
+            bot.send_message(
+                message.chat.id, msg.to_markdown(), parse_mode="MarkdownV2"
+            )
+            return
+
+        template = self.find_template(args[0])
+        if template is None:
+            bot.send_message(
+                message.chat.id, f"Template {args[0]} is not schedulable 🤖"
+            )
+            return
+        at = args[1] if len(args) > 1 else None
+        try:
+            self.subscribe(message.chat.id, message.from_user.id, template, at)
+        except ValueError:
+            bot.send_message(message.chat.id, "Time should be like 21:30 🤖")
+            return
+        at = at or self.jobs[template].at
+        bot.send_message(message.chat.id, f"I will remind you of {template} at {at} ⏰")
+
+    def __command_unremind(self, message: Message):
+        "/unremind template"
+        bot: telebot.TeleBot = self.bot
+        template = self.find_template(extract_arguments(message.text or "").strip())
+        if template and self.unsubscribe(message.chat.id, template):
+            bot.send_message(message.chat.id, f"Reminder of {template} removed 🔕")
+        else:
+            bot.send_message(message.chat.id, "No such reminder 🤖")
@@ -0,0 +1,88 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Final
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from decouple import config
+
+from .query import QueryService, parse_duration
+
+HOST: Final = config("QUERY_HOST", default="127.0.0.1")
+PORT: Final = config("QUERY_PORT", default=8765, cast=int)
+MAX_LIMIT: Final = 1000  # records per response
+
+
+class QueryServer:
+    """
+    Local HTTP JSON API over QueryService, for dashboards.
+    GET /tables
+    GET /records/<table>?since=&until=&last=7d&cursor=&limit=&<field>=<value>
+    limit is 1 to MAX_LIMIT, larger values are capped
+    """
+
+    reserved = ("since", "until", "last", "cursor", "limit")
+
+    def __init__(self, query: QueryService, host: str = HOST, port: int = PORT):
+        self.query = query
+        self.host = host
+        self.port = port
+        self.httpd: ThreadingHTTPServer = None
+        self._thread: threading.Thread = None
+
+    def handle(self, path: str) -> tuple[int, dict]:
+        "return: (status code, json body) of given request path"
+        url = urlsplit(path)
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        if parts == ["tables"]:
+            return 200, {"tables": self.query.tables}
+        if len(parts) != 2 or parts[0] != "records":
+            return 404, {"error": "not found"}
+
+        params = dict(parse_qsl(url.query))
+        try:
+            since = int(params["since"]) if "since" in params else None
+            until = int(params["until"]) if "until" in params else None
+            if "last" in params:
+                since = int(self.query.now()) - parse_duration(params["last"])
+            cursor = int(params["cursor"]) if "cursor" in params else None
+            limit = int(params["limit"]) if "limit" in params else None
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        if limit is not None:
+            if limit < 1:
+                return 400, {"error": f"invalid limit: {limit}"}
+            limit = min(limit, MAX_LIMIT)
+        where = {k: v for k, v in params.items() if k not in self.reserved}
+        page = self.query.find(parts[1], since, until, where, cursor, limit)
+        return 200, {"items": page.items, "cursor": page.cursor}
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.handle(self.path)
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug("query api: " + format, *args)
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.httpd.server_address[1]  # in case port 0 is given
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="query-api", daemon=True
+        )
+        self._thread.start()
+        logging.info("query api is serving at http://%s:%d", self.host, self.port)
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
@@ -1,17 +1,42 @@
+import hashlib
+import json
 import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from itertools import chain
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Final, List, Optional
+from tempfile import NamedTemporaryFile, TemporaryFile
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Final,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
 import telebot
 from decouple import config
 from telebot.types import InputFile, Message
+from telebot.util import extract_arguments
 from telegram_text import Code, PlainText
-from tinydb import Query, TinyDB
+from tinydb import TinyDB
+from tinydb.storages import Storage
+from tinydb.table import Table
 from webdav3.client import Client
 
 from ..utils import is_small_file, readable_time, save_file
 
+T = TypeVar("T")
+
 HOSTNAME: Final = config("WEBDAV_HOSTNAME", default="")
 USERNAME: Final = config("WEBDAV_USERNAME", default="")
 PASSWORD: Final = config("WEBDAV_PASSWORD", default="")
@@ -69,49 +94,403 @@ class WebDAV:
         raise NotImplementedError
 
 
+def content_key(item: dict, exclude: str = "_key") -> str:
+    "identity of a record by its content (excluding field `exclude`)"
+    content = {k: v for k, v in item.items() if k != exclude}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+class DocumentReader:
+    """
+    Read TinyDB json file incrementally, document by document, so memory use
+    is bounded by chunk size and the largest document instead of file size.
+    """
+
+    def __init__(self, file: IO[str], chunk_size: int = 1 << 16) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        "yield (table, document) in file order"
+        for table, documents in self.tables():
+            for _, doc in documents:
+                yield table, doc
+
+    def tables(self) -> Iterator[Tuple[str, Iterator[Tuple[int, dict]]]]:
+        """yield (table, documents) in file order, including empty tables
+        documents yields (doc id, document), it is only valid until next table
+        """
+        if self.peek() is None:
+            return  # empty file
+        self.expect("{")
+        while self.peek() != "}":
+            table = self.decode()
+            self.expect(":")
+            documents = self.documents()
+            yield table, documents
+            for _ in documents:  # skip documents not consumed
+                pass
+            self.skip(",")
+        self.expect("}")
+
+    def documents(self) -> Iterator[Tuple[int, dict]]:
+        self.expect("{")
+        while self.peek() != "}":
+            doc_id = int(self.decode())
+            self.expect(":")
+            yield doc_id, self.decode()
+            self.skip(",")
+        self.expect("}")
+
+    def fill(self) -> bool:
+        "read next chunk, dropping consumed data, return False at end of file"
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return not self.eof
+
+    def peek(self) -> str | None:
+        "next non-whitespace character, None at end of file"
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char: str):
+        if (c := self.peek()) != char:
+            near = self.buffer[self.pos : self.pos + 20]
+            raise ValueError(f"expect {char!r} but get {c!r} near {near!r}")
+        self.pos += 1
+
+    def skip(self, char: str):
+        if self.peek() == char:
+            self.pos += 1
+
+    def decode(self) -> Any:
+        "decode next json value, reading more chunks if it is incomplete"
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            if end == len(self.buffer) and self.fill():
+                continue  # a number may be cut off at the end of buffer
+            self.pos = end
+            return value
+
+
+class AtomicJSONStorage(Storage):
+    """
+    JSON storage for TinyDB that never modifies the database file in place.
+    Data is written to a temporary file and renamed over the database file,
+    so a crash leaves either the old or the new version, and an opened (or
+    hard linked) database file always stays a consistent snapshot.
+    """
+
+    def __init__(self, path: str, encoding: str = "utf-8", **kwargs) -> None:
+        """
+        path: database file path
+        kwargs: passed to json.dumps
+        """
+        super().__init__()
+        self.path = Path(path)
+        self.encoding = encoding
+        self.kwargs = kwargs
+        self.path.touch(exist_ok=True)
+        self.mode = self.path.stat().st_mode & 0o777  # keep it for new versions
+        # clean up temporary files left by interrupted writes
+        for tmp in self.path.parent.glob(f".{self.path.name}.*.tmp"):
+            tmp.unlink(missing_ok=True)
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        try:
+            with open(self.path, encoding=self.encoding) as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(content) if content else None  # None to initialize
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        serialized = json.dumps(data, **self.kwargs)
+        with self.atomic_write() as f:
+            f.write(serialized)
+
+    @contextmanager
+    def atomic_write(self) -> Iterator[IO[str]]:
+        "file to write a new version into, it replaces database file on success"
+        f = NamedTemporaryFile(
+            "w",
+            encoding=self.encoding,
+            dir=self.path.parent,
+            prefix=f".{self.path.name}.",
+            suffix=".tmp",
+            delete=False,
+        )
+        try:
+            with f:
+                os.chmod(f.name, self.mode)  # temporary file is private by default
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f.name, self.path)
+        except BaseException:
+            Path(f.name).unlink(missing_ok=True)
+            raise
+        if hasattr(os, "O_DIRECTORY"):  # make the rename durable (POSIX)
+            fd = os.open(self.path.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+class ProgressMessage:
+    """
+    Progress callback that edits a status message from its own thread, so the
+    reporting task (e.g. restore, which holds the database lock) only records
+    the latest progress and never waits for Telegram.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, msg: Message, interval: float = 3.0):
+        """
+        msg: status message to edit
+        interval: seconds between edits
+        """
+        self.bot = bot
+        self.msg = msg
+        self.interval = interval
+        self.latest: Tuple[int, int, int] = None  # (item number, done, total)
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+
+    def __call__(self, num: int, done: int, total: int):
+        self.latest = (num, done, total)
+
+    def __enter__(self) -> "ProgressMessage":
+        self._thread = threading.Thread(target=self.__loop, name="progress")
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def __loop(self):
+        sent = None
+        while not self._stopped.wait(self.interval):
+            if (latest := self.latest) is None or latest == sent:
+                continue
+            num, done, total = sent = latest
+            text = f"restoring... {done * 100 // max(total, 1)}%, {num} item(s) 🤖"
+            try:
+                self.bot.edit_message_text(text, self.msg.chat.id, self.msg.message_id)
+            except Exception:
+                logging.warning("failed to report progress")
+
+
 class DataBase:
-    """TinyDB management with WebDAV"""
+    """
+    TinyDB management with WebDAV
+    Every record written by `insert` or `upsert` stores its identity in
+    `keyfield`, which is unique within its table (records, template tables,
+    register_info, schedules, timezones). Records without it, e.g. written by
+    older versions, are identified by hash of their content.
+    All writes must go through methods of this class to hold the write lock.
+    """
+
+    keyfield = "_key"  # identity of record, unique within a table
 
     def __init__(
         self, bot: telebot.TeleBot, db_path: str = "db.json", websync=True
     ) -> None:
         self.bot = bot
         self.db_path = db_path
-        self.database = TinyDB(db_path)
+        self.database = TinyDB(db_path, storage=AtomicJSONStorage)
         self.webdav = WebDAV() if websync else None
+        # called with names of changed tables after data changed
+        self.listeners: List[Callable[[Set[str]], None]] = []
+        self.version = 0  # increased after every write, e.g. to key caches
+        # insert() calls, and restored / skipped documents of restore()
+        self.counters = dict.fromkeys(
+            ("inserted", "duplicates", "restored", "restore_skipped"), 0
+        )
+        self._index: Dict[str, Dict[str, int]] = {}  # table -> {key: doc_id}
+        # tables of mutable state (e.g. schedules), restored only if missing here
+        self.state_tables: Set[str] = set()
+        self._lock = threading.RLock()
+
+    def add_listener(self, listener: Callable[[Set[str]], None]):
+        """listener will be called with names of changed tables after every write,
+        e.g. to clear caches of these tables"""
+        self.listeners.append(listener)
+
+    def notify(self, *tables: str):
+        "called after every write with changed tables"
+        with self._lock:
+            self.version += 1
+        for listener in self.listeners:
+            listener(set(tables))
 
     @property
     def status(self):
         db = self.database
         return {t: len(db.table(t)) for t in db.tables()}
 
-    def insert(self, item: dict, table: str = None) -> int:
+    @property
+    def metrics(self) -> dict:
+        """counters since start, duplicate rate is of insert() calls only, i.e.
+        redelivered messages, restore is counted separately"""
+        total = self.counters["inserted"] + self.counters["duplicates"]
+        rate = self.counters["duplicates"] / total if total else 0.0
+        return dict(self.counters, duplicate_rate=round(rate, 4))
+
+    def key_of(self, doc: dict) -> str:
+        "identity of a stored record, hash of content if it has no key"
+        return doc.get(self.keyfield) or content_key(doc, self.keyfield)
+
+    def index_of(self, table: str) -> Dict[str, int]:
+        "unique index of table, built from the keys stored in records on first use"
+        if (index := self._index.get(table)) is None:
+            index = self._index[table] = {
+                self.key_of(doc): doc.doc_id for doc in self.database.table(table)
+            }
+        return index
+
+    def insert(self, item: dict, table: str = None, key: str = None) -> int:
         """
-        Add a record. Please avoid timestamp collision.
-        Records with same timestamp will be overwritten.
+        Add a record idempotently.
+        key: identity of the record, e.g. "chat_id:message_id" of the message
+        it comes from. Defaults to hash of the content.
+        return: doc id, the existing one if a record with the same key exists
         """
-        table = self.database.table(table) if table else self.database
-        doc_id = table.insert(item) if item else 0  # if item is empty, skip it
+        if not item:
+            return 0  # if item is empty, skip it
+        table = table or self.database.default_table_name
+        key = key or content_key(item, self.keyfield)
+        with self._lock:
+            index = self.index_of(table)
+            if (doc_id := index.get(key)) is not None:
+                self.counters["duplicates"] += 1
+                logging.info("duplicated record %s of id %d is skipped", key, doc_id)
+                return doc_id
+            doc_id = self.database.table(table).insert({**item, self.keyfield: key})
+            index[key] = doc_id
+            self.counters["inserted"] += 1
         logging.info("new record of id {}: {}".format(doc_id, item))
+        self.notify(table)
         return doc_id
 
+    def upsert(self, item: dict, table: str, key: str) -> int:
+        """
+        Add a record, or update fields of the record with the same key.
+        Use it for state that changes, e.g. settings keyed by chat id.
+        return: doc id
+        """
+        with self._lock:
+            index, tb = self.index_of(table), self.database.table(table)
+            if (doc_id := index.get(key)) is not None:
+                tb.update(item, doc_ids=[doc_id])
+            else:
+                doc_id = index[key] = tb.insert({**item, self.keyfield: key})
+        self.notify(table)
+        return doc_id
+
+    def update(self, fields: dict, table: str, key: str) -> bool:
+        "update fields of the record with key, return False if it doesn't exist"
+        with self._lock:
+            if (doc_id := self.index_of(table).get(key)) is None:
+                return False
+            self.database.table(table).update(fields, doc_ids=[doc_id])
+        self.notify(table)
+        return True
+
+    def remove(self, table: str, key: str) -> bool:
+        "remove the record with key, return False if it doesn't exist"
+        with self._lock:
+            if (doc_id := self.index_of(table).pop(key, None)) is None:
+                return False
+            self.database.table(table).remove(doc_ids=[doc_id])
+        self.notify(table)
+        return True
+
+    def write(self, table: str, fn: Callable[[Table], T]) -> T:
+        """
+        Run fn(table) holding the write lock, for writes not covered above.
+        TinyDB rewrites the whole file on each write, so every write must hold
+        the lock or it may overwrite a concurrent one.
+        """
+        with self._lock:
+            result = fn(self.database.table(table))
+            self._index.pop(table, None)  # rebuilt on next use
+        self.notify(table)
+        return result
+
     def size_of(self, table: str = None) -> int:
         table = self.database.table(table) if table else self.database
         return len(table)
 
+    def snapshot(self, dest: str = None) -> str:
+        """point-in-time copy of database file, without blocking writers
+        dest: snapshot path, defaults to a new file next to the database
+        return: snapshot path, remove it after use
+        """
+        if dest is None:
+            path = Path(self.db_path)
+            dest = str(path.with_stem(f"{path.stem}.snapshot-{time.time_ns()}"))
+        try:
+            # database file is replaced, not modified, on write (AtomicJSONStorage)
+            # so a hard link keeps the current version unchanged
+            os.link(self.db_path, dest)
+        except OSError:
+            shutil.copyfile(self.db_path, dest)  # the opened file is stable too
+        return dest
+
     def backup(self) -> str:
         """if WebDAV is available, backup the database"""
         if self.webdav is None:
             logging.error("WebDAV is not available")
             return
         filename = "%s.json" % readable_time(format="YYYYMMDDHHmmss")
-        self.webdav.upload(self.db_path, filename)
+        snapshot = self.snapshot()
+        try:
+            self.webdav.upload(snapshot, filename)
+        finally:
+            os.remove(snapshot)
         logging.error("backup %s to WebDAV", filename)
         return filename
 
-    def restore(self, path: str = None) -> int:
+    def restore(
+        self,
+        path: str = None,
+        batch_size: int = 1000,
+        progress: Callable[[int, int, int], None] = None,
+    ) -> int:
         """restore data from file
+        Both files are streamed: the database is indexed, new documents of the
+        backup are spilled to temporary files, then the database and spilled
+        documents are written into a new version of database file, which
+        replaces it at once. Memory use is bounded by the key index (a short
+        entry per record), not by the size of documents or files.
+        Tables in `state_tables` are only restored if they don't exist here.
         path (str, optional): file with data to restore. Defaults to None.
+        batch_size (int, optional): number of restored items between progress
+            reports, also reported at the end of each table.
+        progress (callable, optional): called with
+            (restored item number, processed size, file size)
         return: updated item number
         """
         if path is None:
@@ -121,60 +500,134 @@ class DataBase:
             path = "temp.json"
             self.webdav.download_latest(path)
 
-        source_db = TinyDB(path)
-        dest_db = self.database
-
-        source_tables = (source_db.table(tb) for tb in source_db.tables())
-        dest_tables = (dest_db.table(tb) for tb in source_db.tables())
-        count = 0
-        for src, dst in zip(source_tables, dest_tables):
-            for doc in src:
-                if not dst.contains(Query().fragment(doc)):
-                    dst.insert(dict(doc))  # removing doc id
-                    count += 1
+        count, total = 0, os.path.getsize(path)
+        storage: AtomicJSONStorage = self.database.storage
+        with self._lock, ExitStack() as stack:
+            try:
+                # keys and next doc id of existing tables
+                next_ids: Dict[str, int] = {}
+                with open(self.db_path, encoding="utf-8") as f:
+                    for table, documents in DocumentReader(f).tables():
+                        index = self._index[table] = {}
+                        last = 0
+                        for doc_id, doc in documents:
+                            index[self.key_of(doc)] = doc_id
+                            last = max(last, doc_id)
+                        next_ids[table] = last + 1
+
+                # local state is newer than backup, including removed records
+                live = set(next_ids)
+                skipped = self.state_tables & live
+                spills: Dict[str, IO[str]] = {}  # table -> '"doc_id": doc' lines
+
+                def report():
+                    if progress is not None:
+                        progress(count, f.tell(), total)
+
+                with open(path, encoding="utf-8") as f:
+                    for table, documents in DocumentReader(f).tables():
+                        if table in skipped:
+                            continue
+                        index, pending = self._index.setdefault(table, {}), 0
+                        for _, doc in documents:
+                            key = self.key_of(doc)
+                            if key in index:
+                                self.counters["restore_skipped"] += 1
+                                continue
+                            doc_id = index[key] = next_ids.get(table, 1)
+                            next_ids[table] = doc_id + 1
+                            if (spill := spills.get(table)) is None:
+                                spill = spills[table] = stack.enter_context(
+                                    TemporaryFile(
+                                        "w+", encoding="utf-8", dir=storage.path.parent
+                                    )
+                                )
+                            doc = json.dumps(
+                                {**doc, self.keyfield: key}, **storage.kwargs
+                            )
+                            spill.write(f'"{doc_id}": {doc}\n')
+                            count, pending = count + 1, pending + 1
+                            if pending == batch_size:
+                                report()
+                                pending = 0
+                        if pending:
+                            report()
+
+                if count:
+                    self.__merge(spills, live)
+            except BaseException:
+                self._index.clear()  # may have keys not written, rebuilt on use
+                raise
+        self.counters["restored"] += count
         logging.info("restore %d records from file %s", count, path)
+        if count:
+            self.notify(*spills)
         return count
 
+    def __merge(self, spills: Dict[str, IO[str]], live: Set[str]):
+        """write database and spilled documents into a new version of database file
+        spills: table -> lines of '"doc_id": document' to append to the table
+        live: tables in database, others in spills are appended after them
+        """
+        storage: AtomicJSONStorage = self.database.storage
+        with storage.atomic_write() as out, open(self.db_path, encoding="utf-8") as f:
+            tables = DocumentReader(f).tables()
+            new = [(table, iter(())) for table in spills if table not in live]
+            out.write("{")
+            for i, (table, documents) in enumerate(chain(tables, new)):
+                out.write((", " if i else "") + json.dumps(table) + ": {")
+                sep = ""
+                for doc_id, doc in documents:
+                    out.write(f'{sep}"{doc_id}": {json.dumps(doc, **storage.kwargs)}')
+                    sep = ", "
+                if (spill := spills.get(table)) is not None:
+                    spill.seek(0)
+                    for line in spill:
+                        out.write(sep + line.rstrip("\n"))
+                        sep = ", "
+                out.write("}")
+            out.write("}")
+        # tables cache next doc ids, which are taken by restored documents
+        self.database.close()
+        self.database = TinyDB(self.db_path, storage=AtomicJSONStorage)
+
     def register_commands(self):
         self.bot.register_message_handler(self.__command_backup, commands=["backup"])
         self.bot.register_message_handler(self.__command_restore, commands=["restore"])
 
     def __command_restore(self, message: Message):
         """
-        restore from webdav
+        restore from webdav, or from uploaded document with `/restore file`
         """
+        bot: telebot.TeleBot = self.bot
 
-        def restore_from_file(query):
-            "deprecated"
-            chat_id, message_id = query.message.chat.id, query.message.message_id
-            self.bot.edit_message_text(
-                "Give me a document to restore 🤖", chat_id, message_id
-            )
-
-            def save_file_from_message(message):
-                if message.content_type != "document":
-                    self.bot.send_message(
-                        message.chat.id, "You have to upload a file 🤖"
-                    )
-                    return
+        def save_file_from_message(message: Message):
+            if message.content_type != "document":
+                bot.send_message(message.chat.id, "You have to upload a file 🤖")
+                return
 
-                url = self.bot.get_file_url(message.document.file_id)
+            url = bot.get_file_url(message.document.file_id)
+            msg = bot.send_message(message.chat.id, f"Received, in processing...")
+            try:
                 save_file(url, "temp.json")
-                msg = self.bot.send_message(
-                    message.chat.id, f"Received, in processing..."
-                )
-                num = self.restore("temp.json")
-                self.bot.edit_message_text(
-                    f"updated {num} item(s) successfully 😃, status: {self.status}",
-                    msg.chat.id,
-                    msg.message_id,
-                )
-
-            bot.register_next_step_handler(query.message, save_file_from_message)
+                with ProgressMessage(bot, msg) as progress:
+                    num = self.restore("temp.json", progress=progress)
+            finally:
+                Path("temp.json").unlink(missing_ok=True)
+            bot.edit_message_text(
+                f"updated {num} item(s) successfully 😃, status: {self.status}",
+                msg.chat.id,
+                msg.message_id,
+            )
+
+        if extract_arguments(message.text or "").strip() == "file":
+            bot.send_message(message.chat.id, "Give me a document to restore 🤖")
+            bot.register_next_step_handler(message, save_file_from_message)
+            return
 
-        bot: telebot.TeleBot = self.bot
         msg = bot.send_message(message.chat.id, f"in processing... 🤖")
-        num = self.restore()
+        with ProgressMessage(bot, msg) as progress:
+            num = self.restore(progress=progress)
         bot.edit_message_text(
             f"updated {num} item(s) successfully 😃, status: {self.status}",
             msg.chat.id,
@@ -184,12 +637,16 @@ class DataBase:
     def __command_backup(self, message: Message):
         """ """
         bot: telebot.TeleBot = self.bot
-        filepath: str = self.db_path
         # backup to webdav
         result: str | None = self.backup()
         bot.send_message(message.chat.id, "backup to webdav " + str(result))
         # backup locally
         # TODO: Get file ID
-        if not is_small_file(filepath):
-            bot.send_message(message.chat.id, "Database is too big to backup 👀")
-        bot.send_document(message.chat.id, InputFile(filepath), caption="Backup")
+        filepath: str = self.snapshot()
+        try:
+            if not is_small_file(filepath):
+                bot.send_message(message.chat.id, "Database is too big to backup 👀")
+                return
+            bot.send_document(message.chat.id, InputFile(filepath), caption="Backup")
+        finally:
+            os.remove(filepath)
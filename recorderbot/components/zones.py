@@ -0,0 +1,105 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Set
+
+import telebot
+from telebot.types import Message
+from telebot.util import extract_arguments
+from tinydb import Query
+from zoneinfo import ZoneInfoNotFoundError
+
+from ..utils import TIMEZONE, get_tz, readable_time, readable_times
+from .storage import DataBase
+
+
+class TimeZones:
+    """
+    Per-user timezone preference, stored in database and cached in memory.
+    Format timestamps in the timezone of the chat.
+    """
+
+    tablename = "timezones"
+
+    def __init__(
+        self, bot: telebot.TeleBot, db: DataBase, default: str = TIMEZONE
+    ) -> None:
+        self.bot = bot
+        self.db = db
+        self.default = default
+        self._cache: Dict[int, str] = {}  # chat_id -> timezone name
+        # called with (chat_id, timezone) after timezone of chat is changed
+        self.listeners: List[Callable[[int, str], None]] = []
+        db.state_tables.add(self.tablename)  # don't merge stale state on restore
+        db.add_listener(self.__changed)
+
+    @property
+    def table(self):
+        return self.db.database.table(self.tablename)
+
+    def register_commands(self):
+        self.bot.register_message_handler(
+            self.__command_timezone, commands=["timezone"]
+        )
+
+    def add_listener(self, listener: Callable[[int, str], None]):
+        "listener will be called with (chat_id, timezone) after it is set"
+        self.listeners.append(listener)
+
+    def __changed(self, tables: Set[str]):
+        "clear cache if preferences are changed, e.g. restored from backup"
+        if self.tablename in tables:
+            self._cache.clear()
+
+    def get(self, chat_id: int) -> str:
+        "timezone name of chat, default if not set"
+        if (tz := self._cache.get(chat_id)) is None:
+            doc = self.table.get(Query().chat_id == chat_id)
+            tz = self._cache[chat_id] = doc["timezone"] if doc else self.default
+        return tz
+
+    def set(self, chat_id: int, tz: str) -> str:
+        """set timezone of chat
+        tz: IANA timezone name, e.g. "Europe/London"
+        raise ValueError if tz is unknown
+        """
+        try:
+            get_tz(tz)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"unknown timezone: {tz}")
+        self.db.upsert(
+            {"chat_id": chat_id, "timezone": tz}, self.tablename, str(chat_id)
+        )
+        self._cache[chat_id] = tz  # after upsert, which clears the cache
+        logging.info("timezone of chat %d is set to %s", chat_id, tz)
+        for listener in self.listeners:
+            listener(chat_id, tz)
+        return tz
+
+    def format(
+        self, timestamp: int, chat_id: int, format: str = "YYYY-MM-DD HH:mm:ss"
+    ) -> str:
+        return readable_time(timestamp, format, self.get(chat_id))
+
+    def format_many(
+        self,
+        timestamps: Iterable[int],
+        chat_id: int,
+        format: str = "YYYY-MM-DD HH:mm:ss",
+    ) -> List[str]:
+        return readable_times(timestamps, format, self.get(chat_id))
+
+    def __command_timezone(self, message: Message):
+        "/timezone [Area/City]"
+        bot: telebot.TeleBot = self.bot
+        chat_id = message.chat.id
+        if tz := extract_arguments(message.text or "").strip():
+            try:
+                self.set(chat_id, tz)
+            except ValueError:
+                bot.send_message(
+                    chat_id, f"Unknown timezone {tz}, try Asia/Shanghai 🤖"
+                )
+                return
+        tz = self.get(chat_id)
+        bot.send_message(
+            chat_id, f"Your timezone is {tz}, now {self.format(None, chat_id)}"
+        )
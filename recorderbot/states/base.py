@@ -82,6 +82,11 @@ class StepStatesGroup:
         "description of this states group"
         return self._cfg["description"]
 
+    @property
+    def schedule(self) -> str | None:
+        "time of day (HH:mm) to prompt subscribed users, None if not schedulable"
+        return self._cfg.get("schedule")
+
     @property
     def state_list(self) -> List[StepState]:
         "states of this group"
@@ -1,8 +1,16 @@
 import os
+import time
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from typing import Final, Iterable, List
+from zoneinfo import ZoneInfo
 
 import arrow
 import requests
 import yaml
+from arrow.formatter import DateTimeFormatter
+
+TIMEZONE: Final = "Asia/Shanghai"
 
 
 def is_small_file(file_path: str) -> bool:
@@ -17,26 +25,90 @@ def is_small_file(file_path: str) -> bool:
     return False
 
 
-def readable_time(timestamp: int = None, format: str = "YYYY-MM-DD HH:mm:ss") -> str:
+@lru_cache(maxsize=None)
+def get_tz(name: str = TIMEZONE) -> tzinfo:
+    "cached tz object of given IANA name, raise ZoneInfoNotFoundError if unknown"
+    return ZoneInfo(name)
+
+
+ARROW_TOKENS = {
+    "YYYY": "%Y",
+    "MM": "%m",
+    "DD": "%d",
+    "HH": "%H",
+    "mm": "%M",
+    "ss": "%S",
+}
+FORMAT_RE = DateTimeFormatter._FORMAT_RE  # tokens of arrow format
+
+
+@lru_cache(maxsize=64)
+def to_strftime(format: str) -> str | None:
+    """translate arrow format into strftime format, tokenized the same as arrow
+    return: None if format contains tokens other than ARROW_TOKENS
+    """
+    result, end = [], 0
+    for match in FORMAT_RE.finditer(format):
+        token = match.group(0)
+        if token.startswith("["):  # escaped text
+            token = token[1:-1].replace("%", "%%")
+        elif (token := ARROW_TOKENS.get(token)) is None:
+            return None
+        result += [format[end : match.start()].replace("%", "%%"), token]
+        end = match.end()
+    result.append(format[end:].replace("%", "%%"))
+    return "".join(result)
+
+
+def readable_time(
+    timestamp: int = None, format: str = "YYYY-MM-DD HH:mm:ss", tz: str = TIMEZONE
+) -> str:
     """Get readdable time string of given timestamp
 
     Args:
         timestamp (int, optional): timestamp. Defaults to None (now).
-        format (str, optional): format. Defaults to "YYYY-MM-DD HH:mm:ss".
+        format (str, optional): arrow style format. Defaults to "YYYY-MM-DD HH:mm:ss".
+        tz (str, optional): timezone. Defaults to TIMEZONE.
+
+    Returns:
+        str: formated time string, in timezone tz
+    """
+    return readable_times([timestamp or time.time()], format, tz)[0]
+
+
+def readable_times(
+    timestamps: Iterable[int], format: str = "YYYY-MM-DD HH:mm:ss", tz: str = TIMEZONE
+) -> List[str]:
+    """Batch version of readable_time, timezone and format are resolved only once
+
+    Args:
+        timestamps (Iterable[int]): timestamps, None is formatted as empty string
+        format (str, optional): arrow style format. Defaults to "YYYY-MM-DD HH:mm:ss".
+        tz (str, optional): timezone. Defaults to TIMEZONE.
 
     Returns:
-        str: formated time string, in timezone Asia/Shanghai
+        List[str]: formated time strings, in timezone tz
     """
-    t = arrow.get(timestamp) if timestamp else arrow.get()
-    return t.to("Asia/Shanghai").format(format)
+    fmt, zone = to_strftime(format), get_tz(tz)
+    if fmt is None:  # fallback to arrow for uncommon tokens
+        return [
+            "" if t is None else arrow.get(t).to(zone).format(format)
+            for t in timestamps
+        ]
+    fromtimestamp = datetime.fromtimestamp
+    return [
+        "" if t is None else fromtimestamp(t, zone).strftime(fmt) for t in timestamps
+    ]
 
 
 def save_file(url: str, filename="temp.txt"):
-    response = requests.get(url)
-    with open(filename, "wb") as f:
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
+    "download file in chunks, without holding the whole content in memory"
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(filename, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                if chunk:
+                    f.write(chunk)
 
 
 def load_yaml(path: str) -> dict:
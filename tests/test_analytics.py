@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from recorderbot.components.analytics import Analytics
+from recorderbot.components.storage import DataBase
+
+
+class FakeClock:
+    def __init__(self, start: float = 0) -> None:
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_analytics(path, clock=None) -> Analytics:
+    db = DataBase(None, str(path), websync=False)
+    analytics = Analytics(db, capacity=100, timeout=3600, clock=clock or FakeClock())
+    analytics.register_template("second-thoughts", "help", ["situation", "mood"])
+    return analytics
+
+
+def test_funnel(tmp_path):
+    clock = FakeClock()
+    analytics = make_analytics(tmp_path / "db.json", clock)
+    # user 1 finishes the template
+    analytics.enter(1, 1, "second-thoughts", "situation")
+    clock.now = 10
+    analytics.answer(1, 1, "second-thoughts", "situation")
+    analytics.enter(1, 1, "second-thoughts", "mood")
+    clock.now = 30
+    analytics.answer(1, 1, "second-thoughts", "mood")
+    # user 2 starts over, user 3 goes away
+    analytics.enter(2, 2, "second-thoughts", "situation")
+    analytics.enter(2, 2, "second-thoughts", "situation")
+    analytics.enter(3, 3, "second-thoughts", "situation")
+    clock.now = 30 + 3601
+    assert analytics.expire() == 2
+
+    (s1, situation), (s2, mood) = analytics.funnel("second-thoughts")
+    assert (s1, s2) == ("situation", "mood")
+    assert situation == {"entered": 4, "answered": 1, "abandoned": 3, "seconds": 10}
+    assert mood == {"entered": 1, "answered": 1, "abandoned": 0, "seconds": 20}
+
+
+def test_flush_and_load(tmp_path):
+    analytics = make_analytics(tmp_path / "db.json")
+    analytics.enter(1, 1, "second-thoughts", "situation")
+    analytics.answer(1, 1, "second-thoughts", "situation")
+    assert analytics.flush() == 2
+    assert analytics.flush() == 0
+    assert len(analytics.store.table(Analytics.tablename)) == 2
+    assert analytics.db.database.tables() == set()  # records are not touched
+
+    analytics.store.close()
+    analytics = make_analytics(tmp_path / "db.json")
+    analytics.load()
+    assert analytics.funnel("second-thoughts")[0][1]["answered"] == 1
+
+
+def test_event_retention(tmp_path):
+    analytics = make_analytics(tmp_path / "db.json")
+    analytics.max_events = 5
+    for i in range(7):
+        analytics.enter(i, i, "second-thoughts", "situation")
+        analytics.flush()
+    events = analytics.store.table(Analytics.tablename)
+    assert [e["chat_id"] for e in events] == [2, 3, 4, 5, 6]  # latest events
+    assert analytics.funnel("second-thoughts")[0][1]["entered"] == 7
+
+
+def test_failed_flush_keeps_events(tmp_path):
+    analytics = make_analytics(tmp_path / "db.json")
+    for i in range(60):
+        analytics.enter(i, i, "second-thoughts", "situation")
+    table = analytics.store.table(Analytics.tablename)
+    insert_multiple, table.insert_multiple = table.insert_multiple, None
+    with pytest.raises(TypeError):
+        analytics.flush()
+    for i in range(60, 100):  # new events while the write failed
+        analytics.enter(i, i, "second-thoughts", "situation")
+    assert [e[3] for e in analytics.buffer] == list(range(100))
+    analytics.enter(100, 100, "second-thoughts", "situation")  # full, drop oldest
+
+    table.insert_multiple = insert_multiple
+    assert analytics.flush() == 100 and analytics.dropped == 1
+    assert [e["chat_id"] for e in table] == list(range(1, 101))
+
+
+def test_ring_buffer_is_bounded(tmp_path):
+    analytics = make_analytics(tmp_path / "db.json")
+    for i in range(150):
+        analytics.enter(i, i, "second-thoughts", "situation")
+    assert len(analytics.buffer) == 100 and analytics.dropped == 50
+    assert analytics.funnel("second-thoughts")[0][1]["entered"] == 150
+
+
+@pytest.mark.skipif(
+    bool(os.environ.get("SKIP_BENCHMARKS")), reason="timing is unreliable here"
+)
+def test_overhead_within_budget(tmp_path):
+    from benchmarks.bench_analytics import BUDGET, overhead
+
+    analytics = make_analytics(tmp_path / "db.json")
+    assert min(overhead(analytics, 20_000) for _ in range(3)) < BUDGET
@@ -0,0 +1,89 @@
+from recorderbot.components.storage import DataBase
+
+
+def make_db(path) -> DataBase:
+    return DataBase(None, str(path), websync=False)
+
+
+def test_insert_idempotent_by_key(tmp_path):
+    db = make_db(tmp_path / "db.json")
+    doc_id = db.insert({"timestamp": 1, "content": "hi"}, "records", "1:10")
+    # redelivered update, content may be edited
+    assert db.insert({"timestamp": 1, "content": "hi!"}, "records", "1:10") == doc_id
+    assert db.insert({"timestamp": 1, "content": "hi"}, "records", "1:11") != doc_id
+    assert db.size_of("records") == 2
+    assert db.metrics == {
+        "inserted": 2,
+        "duplicates": 1,
+        "restored": 0,
+        "restore_skipped": 0,
+        "duplicate_rate": 0.3333,
+    }
+
+
+def test_insert_idempotent_by_content(tmp_path):
+    db = make_db(tmp_path / "db.json")
+    doc_id = db.insert({"chat_id": 1}, "register_info")
+    assert db.insert({"chat_id": 1}, "register_info") == doc_id
+    assert db.insert({"chat_id": 2}, "register_info") != doc_id
+    assert db.size_of("register_info") == 2
+
+
+def test_unique_index_is_persistent(tmp_path):
+    db = make_db(tmp_path / "db.json")
+    doc_id = db.insert({"content": "hi"}, "records", "1:10")
+    db.database.close()
+    db = make_db(tmp_path / "db.json")
+    assert db.insert({"content": "hi"}, "records", "1:10") == doc_id
+    assert db.size_of("records") == 1
+
+
+def test_restore_merge(tmp_path):
+    backup = make_db(tmp_path / "backup.json")
+    backup.insert({"content": "a"}, "records", "1:1")
+    backup.insert({"content": "b"}, "records", "1:2")
+    backup.database.table("records").insert({"content": "legacy"})  # without key
+    backup.database.table("records").insert({"content": "legacy"})
+    backup.database.close()
+
+    db = make_db(tmp_path / "db.json")
+    db.insert({"content": "a"}, "records", "1:1")
+    assert db.restore(str(tmp_path / "backup.json")) == 2
+    assert db.restore(str(tmp_path / "backup.json")) == 0
+    assert sorted(d["content"] for d in db.database.table("records")) == [
+        "a",
+        "b",
+        "legacy",
+    ]
+    legacy = db.database.table("records").get(lambda d: d["content"] == "legacy")
+    assert db.insert({"content": "legacy"}, "records") == legacy.doc_id
+    assert db.size_of("records") == 3
+
+
+def test_restore_is_not_counted_as_duplicates(tmp_path):
+    backup = make_db(tmp_path / "backup.json")
+    for i in range(50):
+        backup.insert({"content": i}, "records", f"1:{i}")
+    backup.database.close()
+
+    db = make_db(tmp_path / "db.json")  # restored on startup into empty database
+    assert db.restore(str(tmp_path / "backup.json")) == 50
+    assert db.restore(str(tmp_path / "backup.json")) == 0  # same as local
+    metrics = db.metrics
+    assert metrics["restored"] == 50 and metrics["restore_skipped"] == 50
+    assert metrics["inserted"] == metrics["duplicates"] == 0
+    assert metrics["duplicate_rate"] == 0.0
+
+
+def test_upsert_by_key(tmp_path):
+    db = make_db(tmp_path / "db.json")
+    doc_id = db.upsert({"chat_id": 1, "timezone": "UTC"}, "timezones", "1")
+    assert (
+        db.upsert({"chat_id": 1, "timezone": "Asia/Tokyo"}, "timezones", "1") == doc_id
+    )
+    assert db.size_of("timezones") == 1
+    assert db.database.table("timezones").get(doc_id=doc_id)["timezone"] == "Asia/Tokyo"
+    assert db.update({"timezone": "UTC"}, "timezones", "1")
+    assert not db.update({"timezone": "UTC"}, "timezones", "2")
+    assert db.remove("timezones", "1") and not db.remove("timezones", "1")
+    assert db.size_of("timezones") == 0
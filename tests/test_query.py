@@ -0,0 +1,109 @@
+import json
+import tracemalloc
+from urllib.parse import quote
+from urllib.request import urlopen
+
+from recorderbot.components.query import Page, QueryService, parse_duration
+from recorderbot.components.server import MAX_LIMIT, QueryServer
+from recorderbot.components.storage import DataBase
+
+NOW = 1_700_000_000
+
+
+def make_query(path, n=25):
+    db = DataBase(None, str(path), websync=False)
+    for i in range(n):
+        db.insert({"timestamp": NOW - i * 86400, "content": str(i)}, "diary")
+    return QueryService(db, page_size=10, clock=lambda: NOW)
+
+
+def test_parse_duration():
+    assert parse_duration("7d") == 7 * 86400
+    assert parse_duration("30m") == 1800
+
+
+def test_query_pagination(tmp_path):
+    query = make_query(tmp_path / "db.json")
+    seen, cursor = [], None
+    while True:
+        page = query.find("diary", cursor=cursor)
+        seen += [i["content"] for i in page.items]
+        if (cursor := page.cursor) is None:
+            break
+    assert seen == [str(i) for i in range(24, -1, -1)]  # newest inserted first
+    assert query.find("missing").items == []
+
+
+def test_query_filters(tmp_path):
+    query = make_query(tmp_path / "db.json")
+    page = query.find("diary", since=NOW - parse_duration("7d"))
+    assert [i["content"] for i in page.items] == [
+        str(i) for i in range(7, -1, -1)
+    ]  # since is included
+    page = query.find("diary", where={"content": "3"})
+    assert len(page.items) == 1 and page.items[0]["timestamp"] == NOW - 3 * 86400
+
+
+def test_query_reads_only_a_page(tmp_path):
+    path = tmp_path / "db.json"
+    docs = {str(i): {"timestamp": i, "pad": "x" * 2000} for i in range(1, 5001)}
+    path.write_text(json.dumps({"other": docs, "diary": docs, "last": docs}))
+    query = QueryService(DataBase(None, str(path), websync=False))
+    tracemalloc.start()
+    page = query.find("diary", cursor=2501)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert [i["doc_id"] for i in page.items] == list(range(2500, 2490, -1))
+    assert page.cursor == 2491
+    assert peak < 1 << 20  # database file is ~30MB
+
+
+def test_query_cache_invalidation(tmp_path):
+    query = make_query(tmp_path / "db.json", n=1)
+    assert len(query.find("diary").items) == 1
+    assert len(query.find("diary").items) == 1
+    assert query.cache_info().hits == 1
+    query.db.insert({"timestamp": NOW, "content": "new"}, "diary")
+    assert len(query.find("diary").items) == 2
+
+
+def test_query_cache_sees_every_write(tmp_path):
+    query = make_query(tmp_path / "db.json", n=0)
+    query.db.upsert({"chat_id": 1}, "schedules", "1:t")
+    assert len(query.find("schedules").items) == 1
+    query.db.upsert({"chat_id": 2}, "schedules", "2:t")
+    assert len(query.find("schedules").items) == 2
+    query.db.write("schedules", lambda table: table.truncate())
+    assert query.find("schedules").items == []
+
+
+def test_query_server(tmp_path):
+    server = QueryServer(make_query(tmp_path / "db.json"), port=0)
+    server.start()
+    try:
+        url = f"http://{server.host}:{server.port}"
+        assert json.load(urlopen(url + "/tables")) == {"tables": ["diary"]}
+        body = json.load(urlopen(url + "/records/diary?last=2d&limit=2"))
+        assert len(body["items"]) == 2 and body["cursor"] is not None
+        body = json.load(
+            urlopen(url + f"/records/diary?last=2d&cursor={body['cursor']}")
+        )
+        assert len(body["items"]) == 1 and body["cursor"] is None
+        assert (
+            json.load(urlopen(url + "/records/diary?content=3"))["items"][0]["doc_id"]
+            == 4
+        )
+    finally:
+        server.stop()
+
+
+def test_query_server_params(tmp_path):
+    query = make_query(tmp_path / "db.json")
+    query.db.insert({"timestamp": NOW, "content": "你好"}, "日记")
+    server = QueryServer(query, port=0)
+    status, body = server.handle("/records/" + quote("日记"))
+    assert status == 200 and body["items"][0]["content"] == "你好"
+    assert server.handle("/records/diary?limit=0")[0] == 400
+    assert server.handle("/records/diary?limit=-1")[0] == 400
+    query.find = lambda table, since, until, where, cursor, limit: Page([limit], None)
+    assert server.handle("/records/diary?limit=99999")[1]["items"] == [MAX_LIMIT]
@@ -0,0 +1,115 @@
+import json
+import threading
+import tracemalloc
+from types import SimpleNamespace
+
+from recorderbot.components.storage import DataBase, DocumentReader, ProgressMessage
+
+
+def write_backup(path, n: int, tables=("records", "diary"), pad: int = 200) -> None:
+    "write a synthetic TinyDB backup of n documents per table without building it"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for t, table in enumerate(tables):
+            f.write(("," if t else "") + json.dumps(table) + ": {")
+            for i in range(n):
+                doc = {"timestamp": i, "content": f"{table} 记录 {i}", "pad": "x" * pad}
+                f.write(("," if i else "") + f'"{i + 1}": ' + json.dumps(doc))
+            f.write("}")
+        f.write("}")
+
+
+def peak_of_reading(path) -> int:
+    tracemalloc.start()
+    with open(path, encoding="utf-8") as f:
+        for _ in DocumentReader(f, chunk_size=1 << 14):
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def test_document_reader(tmp_path):
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    db.insert({"content": "a", "nested": {"list": [1, 2.5, None]}}, "records")
+    db.insert({"content": "b"}, "diary")
+    db.database.table("empty").insert({})
+    db.database.table("empty").truncate()
+    with open(db.db_path, encoding="utf-8") as f:
+        docs = [(t, d["content"]) for t, d in DocumentReader(f, chunk_size=7)]
+    assert docs == [("records", "a"), ("diary", "b")]
+    with open(db.db_path, encoding="utf-8") as f:
+        tables = [(t, list(docs)) for t, docs in DocumentReader(f).tables()]
+    assert [(t, [i for i, _ in docs]) for t, docs in tables] == [
+        ("records", [1]),
+        ("diary", [1]),
+        ("empty", []),
+    ]
+
+
+def test_document_reader_memory_is_bounded(tmp_path):
+    write_backup(tmp_path / "small.json", 2_000)
+    write_backup(tmp_path / "large.json", 40_000)  # ~20MB
+    small, large = (peak_of_reading(tmp_path / f) for f in ("small.json", "large.json"))
+    assert large < 1 << 20
+    assert large < small * 2
+
+
+def test_streaming_restore(tmp_path):
+    write_backup(tmp_path / "backup.json", 2_500)
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    db.insert(
+        {"timestamp": 0, "content": "records 记录 0", "pad": "x" * 200}, "records"
+    )
+    reports = []
+    count = db.restore(
+        str(tmp_path / "backup.json"),
+        batch_size=1000,
+        progress=lambda *args: reports.append(args),
+    )
+    assert count == 4999
+    assert db.size_of("records") == 2500 and db.size_of("diary") == 2500
+    assert [r[0] for r in reports] == [1000, 2000, 2499, 3499, 4499, 4999]
+    assert reports[-1][1] == reports[-1][2]  # whole file is processed
+    assert db.restore(str(tmp_path / "backup.json")) == 0
+    assert db.insert({"content": "new"}, "records") == 2501  # ids are not reused
+
+
+def peak_of_restore(tmp_path, pad: int) -> int:
+    backup = tmp_path / f"backup-{pad}.json"
+    write_backup(backup, 2_000, pad=pad)
+    db = DataBase(None, str(tmp_path / f"db-{pad}.json"), websync=False)
+    db.insert({"content": "local"}, "records")
+    tracemalloc.start()
+    assert db.restore(str(backup)) == 4000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def test_restore_memory_is_bounded(tmp_path):
+    # same number of records, 20 times larger documents (~16MB backup)
+    small, large = peak_of_restore(tmp_path, 200), peak_of_restore(tmp_path, 4000)
+    assert large < 2 << 20
+    assert large < small * 1.5
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.edits = []
+
+    def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append((threading.current_thread().name, text))
+
+
+def test_restore_progress_message(tmp_path):
+    write_backup(tmp_path / "backup.json", 2_500)
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    bot = FakeBot()
+    msg = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=2)
+    reporter = ProgressMessage(bot, msg, interval=0.001)
+    reporter(1, 10, 100)
+    assert bot.edits == []  # callback only records progress
+    with reporter as progress:
+        assert db.restore(str(tmp_path / "backup.json"), 100, progress) == 5000
+    assert bot.edits and all(name == "progress" for name, _ in bot.edits)
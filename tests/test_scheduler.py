@@ -0,0 +1,226 @@
+import threading
+
+import arrow
+
+from recorderbot.components.record import Recorder
+from recorderbot.components.scheduler import Scheduler, next_occurrence
+from recorderbot.components.storage import DataBase
+from recorderbot.components.zones import TimeZones
+from recorderbot.states.base import StepStatesGroup
+
+
+class FakeClock:
+    def __init__(self, start: float) -> None:
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+START = arrow.get("2023-10-01T20:00:00+08:00").timestamp()  # 20:00 in Asia/Shanghai
+
+
+def make_scheduler(path, clock):
+    fired = []
+    scheduler = Scheduler(None, DataBase(None, str(path), websync=False), clock)
+    scheduler.register_template(
+        "daily-check-in", "check", "21:30", lambda c, u: fired.append((c, u))
+    )
+    return scheduler, fired
+
+
+def test_next_occurrence():
+    assert next_occurrence("21:30", START) == START + 90 * 60
+    assert next_occurrence("19:00", START) == START + 23 * 3600
+    assert next_occurrence("20:00", START) == START + 24 * 3600  # strictly after
+
+
+def test_scheduler_fire_and_reschedule(tmp_path):
+    clock = FakeClock(START)
+    scheduler, fired = make_scheduler(tmp_path / "db.json", clock)
+    scheduler.subscribe(1, 1, "daily-check-in")
+    scheduler.subscribe(2, 2, "daily-check-in", "20:30")
+    assert scheduler.next_timeout() == 30 * 60
+
+    assert scheduler.run_pending() == 0
+    clock.now = START + 30 * 60
+    assert scheduler.run_pending() == 1
+    assert fired == [(2, 2)]
+    clock.now = START + 90 * 60
+    assert scheduler.run_pending() == 1
+    assert fired == [(2, 2), (1, 1)]
+    assert scheduler.next_timeout() == 23 * 3600  # 20:30 tomorrow
+
+
+def test_scheduler_defer_busy_user(tmp_path):
+    clock = FakeClock(START)
+    scheduler, _ = make_scheduler(tmp_path / "db.json", clock)
+    prompts = []
+    busy = True
+    scheduler.jobs["daily-check-in"] = scheduler.jobs["daily-check-in"]._replace(
+        prompt=lambda c, u: prompts.append(clock.now) or not busy
+    )
+    scheduler.subscribe(1, 1, "daily-check-in")
+    clock.now = START + 90 * 60
+    assert scheduler.run_pending() == 0
+    assert scheduler.next_timeout() == scheduler.defer  # try again later
+
+    busy = False
+    clock.now += scheduler.defer
+    assert scheduler.run_pending() == 1
+    assert prompts == [START + 90 * 60, START + 90 * 60 + scheduler.defer]
+    assert scheduler.next_timeout() == 24 * 3600 - scheduler.defer  # back on time
+
+
+def test_scheduler_follows_timezone_change(tmp_path):
+    clock = FakeClock(START)
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    zones = TimeZones(None, db)
+    scheduler = Scheduler(None, db, clock, zones)
+    fired = []
+    scheduler.register_template(
+        "daily-check-in", "check", "21:30", lambda c, u: fired.append((c, u))
+    )
+    scheduler.subscribe(1, 1, "daily-check-in")
+    assert scheduler.next_timeout() == 90 * 60
+
+    zones.set(1, "Europe/London")  # 13:00 there, 21:30 is 8.5 hours later
+    [doc] = scheduler.subscriptions(1)
+    assert doc["timezone"] == "Europe/London"
+    assert doc["next_fire"] == START + 8.5 * 3600
+    clock.now = START + 90 * 60
+    assert scheduler.run_pending() == 0  # the old fire time is skipped
+    assert scheduler.next_timeout() == 7 * 3600
+    clock.now = START + 8.5 * 3600
+    assert scheduler.run_pending() == 1 and fired == [(1, 1)]
+
+
+def test_scheduler_fires_many_with_one_write(tmp_path):
+    clock = FakeClock(START)
+    scheduler, fired = make_scheduler(tmp_path / "db.json", clock)
+    busy = set(range(0, 500, 2))
+    scheduler.jobs["daily-check-in"] = scheduler.jobs["daily-check-in"]._replace(
+        prompt=lambda c, u: c not in busy and fired.append(c) is None
+    )
+    scheduler.db.write(
+        Scheduler.tablename,
+        lambda table: table.insert_multiple(
+            {
+                "chat_id": i,
+                "user_id": i,
+                "template": "daily-check-in",
+                "at": "21:30",
+                "timezone": "Asia/Shanghai",
+                "next_fire": START + 90 * 60,
+            }
+            for i in range(500)
+        ),
+    )
+    scheduler.load()
+    clock.now = START + 90 * 60
+    version = scheduler.db.version
+    assert scheduler.run_pending() == 250
+    assert scheduler.db.version == version + 2  # reschedule and postpone
+    assert sorted(fired) == list(range(1, 500, 2))
+    assert scheduler.next_timeout() == scheduler.defer
+
+
+def test_scheduler_unsubscribe(tmp_path):
+    clock = FakeClock(START)
+    scheduler, fired = make_scheduler(tmp_path / "db.json", clock)
+    scheduler.subscribe(1, 1, "daily-check-in")
+    scheduler.subscribe(1, 1, "daily-check-in", "20:30")  # replace
+    assert len(scheduler.subscriptions(1)) == 1
+    assert scheduler.unsubscribe(1, "daily-check-in") == 1
+    clock.now = START + 24 * 3600
+    assert scheduler.run_pending() == 0
+    assert fired == []
+
+
+def test_scheduler_recover_missed_fires(tmp_path):
+    clock = FakeClock(START)
+    scheduler, _ = make_scheduler(tmp_path / "db.json", clock)
+    scheduler.subscribe(1, 1, "daily-check-in")
+    scheduler.db.database.close()
+
+    # bot is down for 3 days, missed fires are collapsed into one
+    clock.now = START + 3 * 24 * 3600
+    scheduler, fired = make_scheduler(tmp_path / "db.json", clock)
+    scheduler.load()
+    assert scheduler.run_pending() == 1
+    assert fired == [(1, 1)]
+    assert scheduler.next_timeout() == 90 * 60
+
+
+def test_scheduler_writes_do_not_lose_records(tmp_path):
+    clock = FakeClock(START)
+    scheduler, _ = make_scheduler(tmp_path / "db.json", clock)
+    db = scheduler.db
+    stop = threading.Event()
+
+    def subscribe():
+        i = 0
+        while not stop.is_set():
+            scheduler.subscribe(i % 10, i % 10, "daily-check-in")
+            i += 1
+
+    writer = threading.Thread(target=subscribe)
+    writer.start()
+    try:
+        for i in range(300):
+            db.insert({"i": i}, "records")
+    finally:
+        stop.set()
+        writer.join()
+    reopened = DataBase(None, db.db_path, websync=False)
+    assert reopened.size_of("records") == 300
+    assert reopened.size_of(Scheduler.tablename) == 10
+
+
+def test_scheduler_state_survives_restore(tmp_path):
+    clock = FakeClock(START)
+    scheduler, _ = make_scheduler(tmp_path / "db.json", clock)
+    scheduler.subscribe(1, 1, "daily-check-in")
+    scheduler.subscribe(2, 2, "daily-check-in")
+    backup = scheduler.db.snapshot(str(tmp_path / "backup.json"))
+    clock.now = START + 90 * 60
+    assert scheduler.run_pending() == 2
+    scheduler.unsubscribe(2, "daily-check-in")
+
+    # restart: restore from the older backup doesn't bring back stale state
+    scheduler, fired = make_scheduler(tmp_path / "db.json", clock)
+    assert scheduler.db.restore(backup) == 0
+    scheduler.load()
+    assert scheduler.run_pending() == 0 and fired == []
+    assert scheduler.subscriptions(2) == []
+
+    # a new database gets subscriptions from backup
+    scheduler, _ = make_scheduler(tmp_path / "new.json", clock)
+    assert scheduler.db.restore(backup) == 2
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.states, self.sent = {}, []
+
+    def get_state(self, user_id, chat_id):
+        return self.states.get((user_id, chat_id))
+
+    def set_state(self, user_id, state, chat_id):
+        self.states[(user_id, chat_id)] = state
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_recorder_prompt_skips_busy_user(tmp_path):
+    bot = FakeBot()
+    recorder = Recorder(bot, DataBase(bot, str(tmp_path / "db.json"), websync=False))
+    group = StepStatesGroup(
+        {"name": "t", "command": "t", "description": "d", "items": {"a": "A?"}}
+    )
+    bot.states[(2, 2)] = "halfway"
+    assert not recorder.prompt(2, 2, group.entry_state)
+    assert bot.states[(2, 2)] == "halfway" and bot.sent == []
+    assert recorder.prompt(1, 1, group.entry_state)
+    assert bot.states[(1, 1)] is group.entry_state
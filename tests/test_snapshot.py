@@ -0,0 +1,103 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from recorderbot.components.storage import DataBase
+
+ROOT = Path(__file__).parent.parent
+
+WRITER = """
+import sys
+from recorderbot.components.storage import DataBase
+
+db = DataBase(None, sys.argv[1], websync=False)
+i = 0
+while True:
+    db.insert({"i": i, "padding": "x" * 1000}, "records")
+    i += 1
+"""
+
+
+def load(path) -> dict:
+    "a valid database file or snapshot is complete json"
+    content = Path(path).read_text(encoding="utf-8")
+    return json.loads(content) if content else {}
+
+
+def count(data: dict) -> int:
+    return len(data.get("records", {}))
+
+
+def test_snapshot_is_point_in_time(tmp_path):
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    db.insert({"i": 0}, "records")
+    snapshot = db.snapshot()
+    db.insert({"i": 1}, "records")
+    assert count(load(snapshot)) == 1
+    assert count(load(db.db_path)) == 2
+    os.remove(snapshot)
+
+
+def test_atomic_write_keeps_file_mode(tmp_path):
+    path = tmp_path / "db.json"
+    path.touch(mode=0o644)
+    db = DataBase(None, str(path), websync=False)
+    db.insert({"i": 0}, "records")
+    assert path.stat().st_mode & 0o777 == 0o644
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_snapshot_during_concurrent_inserts(tmp_path):
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    stop = threading.Event()
+
+    def write():
+        while not stop.is_set():
+            db.insert({"padding": "x" * 1000}, "records")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        sizes = []
+        for _ in range(50):
+            snapshot = db.snapshot()
+            sizes.append(count(load(snapshot)))
+            os.remove(snapshot)
+    finally:
+        stop.set()
+        writer.join()
+    assert sizes == sorted(sizes)
+
+
+def test_killed_writer_leaves_valid_store(tmp_path):
+    path = str(tmp_path / "db.json")
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    reader = DataBase(None, path, websync=False)
+    last = 0
+    for _ in range(5):
+        proc = subprocess.Popen([sys.executable, "-c", WRITER, path], env=env)
+        try:
+            # take snapshots until the writer has made some progress
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                snapshot = reader.snapshot()
+                current = count(load(snapshot))
+                os.remove(snapshot)
+                assert current >= last
+                if current > last + 10:
+                    break
+                time.sleep(0.01)
+        finally:
+            proc.send_signal(signal.SIGKILL)
+            proc.wait()
+        # the store is valid after the writer is killed mid-operation
+        current = count(load(path))
+        assert current >= last
+        last = current
+    assert last > 0
+    assert len(reader.database.table("records")) == last
@@ -0,0 +1,65 @@
+import arrow
+import pytest
+
+from recorderbot.components.storage import DataBase
+from recorderbot.components.zones import TimeZones
+from recorderbot.utils import readable_time, readable_times, to_strftime
+
+TIMESTAMPS = [0, 1_679_792_400, 1_698_544_800, 1_700_000_000]  # around DST changes
+
+
+def test_to_strftime():
+    assert to_strftime("YYYYMMDDHHmmss") == "%Y%m%d%H%M%S"
+    assert to_strftime("100% HH") == "100%% %H"
+    assert to_strftime("dddd HH") is None  # unsupported token
+    assert to_strftime("MMMM DD") is None  # not two MM tokens
+    assert to_strftime("DDDD") is None
+    assert to_strftime("[at] HH:mm") == "at %H:%M"
+
+
+@pytest.mark.parametrize(
+    "tz", ["Asia/Shanghai", "Europe/London", "Australia/Lord_Howe"]
+)
+@pytest.mark.parametrize(
+    "format", ["YYYY-MM-DD HH:mm:ss", "YYYYMMDDHHmmss", "dddd", "MMMM DD", "DDDD"]
+)
+def test_readable_time_same_as_arrow(tz, format):
+    expected = [arrow.get(t).to(tz).format(format) for t in TIMESTAMPS[1:]]
+    assert [readable_time(t, format, tz) for t in TIMESTAMPS[1:]] == expected
+    assert readable_times(TIMESTAMPS[1:], format, tz) == expected
+    assert readable_times([None], format, tz) == [""]
+
+
+def test_readable_time_arrow_tokens():
+    assert readable_time(1_700_000_000, "MMMM DD", "Asia/Shanghai") == "November 15"
+    assert readable_time(1_700_000_000, "DDDD", "Asia/Shanghai") == "319"
+
+
+def test_timezones(tmp_path):
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    zones = TimeZones(None, db)
+    assert zones.get(1) == "Asia/Shanghai"
+    zones.set(1, "Europe/London")
+    with pytest.raises(ValueError):
+        zones.set(1, "Mars/Olympus")
+    assert zones.format(1_700_000_000, 1) == "2023-11-14 22:13:20"
+    assert zones.format_many([1_700_000_000], 2) == ["2023-11-15 06:13:20"]
+
+    # preference is persisted
+    assert TimeZones(None, db).get(1) == "Europe/London"
+
+
+def test_timezones_cache(tmp_path):
+    db = DataBase(None, str(tmp_path / "db.json"), websync=False)
+    zones = TimeZones(None, db)
+    zones.set(1, "Europe/London")
+    db.insert({"content": "hi"}, "records")  # unrelated writes keep the cache
+    assert zones._cache == {1: "Europe/London"}
+
+    backup = DataBase(None, str(tmp_path / "backup.json"), websync=False)
+    TimeZones(None, backup).set(2, "UTC")
+    db = DataBase(None, str(tmp_path / "new.json"), websync=False)
+    zones = TimeZones(None, db)
+    assert zones.get(2) == "Asia/Shanghai"
+    assert db.restore(backup.db_path) == 1  # restored preferences clear the cache
+    assert zones.get(2) == "UTC"